@@ -7,6 +7,12 @@
 # DocumentConfig contains settings used to configure how the SPDX Document
 # should be built.
 class DocumentConfig:
+    __slots__ = (
+        "name",
+        "namespace",
+        "docRefID",
+    )
+
     def __init__(self):
         super(DocumentConfig, self).__init__()
 
@@ -24,6 +30,15 @@ class DocumentConfig:
 # Document contains the data assembled by the SBOM builder, to be used to
 # create the actual SPDX Document.
 class Document:
+    __slots__ = (
+        "cfg",
+        "pkgs",
+        "relationships",
+        "externalDocuments",
+        "customLicenseIDs",
+        "myDocSHA1",
+    )
+
     # initialize with a DocumentConfig
     def __init__(self, cfg):
         super(Document, self).__init__()
@@ -55,6 +70,18 @@ class Document:
 # PackageConfig contains settings used to configure how an SPDX Package should
 # be built.
 class PackageConfig:
+    __slots__ = (
+        "fileListPath",
+        "basedir",
+        "name",
+        "version",
+        "supplierPerson",
+        "supplierOrg",
+        "spdxID",
+        "declaredLicense",
+        "copyrightText",
+    )
+
     def __init__(self):
         super(PackageConfig, self).__init__()
 
@@ -88,6 +115,19 @@ class PackageConfig:
 # Package contains the data assembled by the SBOM builder, to be used to
 # create the actual SPDX Package.
 class Package:
+    __slots__ = (
+        "cfg",
+        "doc",
+        "verificationCode",
+        "concludedLicense",
+        "licenseInfoFromFiles",
+        "files",
+        "fileSHA1s",
+        "fileConcludedLicenses",
+        "fileLicenseInfos",
+        "rlns",
+    )
+
     # initialize with:
     # 1) PackageConfig
     def __init__(self, cfg):
@@ -113,6 +153,19 @@ class Package:
         # dict of SPDX ID => File
         self.files = {}
 
+        # the following hold per-File data used to calculate the Package's
+        # verification code and licenses, as flat lists in the same order
+        # as files, so those calculations don't need to walk every File
+
+        # list of SHA1 hashes of this Package's Files
+        self.fileSHA1s = []
+
+        # list of concluded licenses of this Package's Files
+        self.fileConcludedLicenses = []
+
+        # list of licenseInfoInFile lists of this Package's Files
+        self.fileLicenseInfos = []
+
         # Relationships "owned" by this Package (e.g., this Package is left
         # side)
         self.rlns = []
@@ -120,6 +173,20 @@ class Package:
 # File contains the data needed to create a File element in the context of a
 # particular SPDX Document and Package.
 class File:
+    __slots__ = (
+        "abspath",
+        "relpath",
+        "spdxID",
+        "sha1",
+        "sha256",
+        "concludedLicense",
+        "licenseInfoInFile",
+        "copyrightText",
+        "rlns",
+        "pkg",
+        "doc",
+    )
+
     # initialize with:
     # 1) Package containing this File
     def __init__(self, pkg):
@@ -164,6 +231,12 @@ class File:
 # in a form suitable for creating the actual SPDX Relationship in a particular
 # Document's context.
 class Relationship:
+    __slots__ = (
+        "refA",
+        "refB",
+        "rlnType",
+    )
+
     def __init__(self):
         super(Relationship, self).__init__()
 
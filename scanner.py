@@ -4,13 +4,29 @@
 # Based on zspdx/scanner.py from Zephyr Project:
 # Copyright (c) 2020, 2021 The Linux Foundation
 
+from concurrent.futures import ProcessPoolExecutor
 import hashlib
+from itertools import chain, repeat
+import mmap
 import os
 import re
-import uuid
+import stat
 
 from datatypes import File, Package
-from util import getHashes
+from util import (HASH_CHUNK_SIZE, HASH_MIN_BUFFER_SIZE, PARALLEL_HASH_MIN_SIZE, hashChunks,
+                  hashInParallel)
+
+# tag that marks a file's SPDX license expression
+SPDX_TAG = b"SPDX-License-Identifier:"
+
+# packages with fewer unique files than this are scanned in this process,
+# since starting worker processes takes longer than scanning that many
+# files would save
+PARALLEL_SCAN_MIN_FILES = 512
+
+# patterns used by splitExpression to strip operators from expressions
+PARENS_PLUS_RE = re.compile(r'[()+]')
+OPERATORS_RE = re.compile(r' AND | OR | WITH ', flags=re.IGNORECASE)
 
 # ScannerConfig contains settings used to configure the scanning for
 # SPDX Document creation (e.g. license IDs, hashes, etc.)
@@ -34,6 +50,10 @@ class ScannerConfig:
         # should we also calculate SHA256 hashes for each File?
         self.doSHA256 = True
 
+        # number of worker processes to use for hashing and scanning Files
+        # (0 = one per CPU)
+        self.numWorkers = 0
+
 def scanPackage(scanCfg, pkgCfg):
     """
     Scan for licenses and calculate hashes for all files specified in
@@ -47,41 +67,72 @@ def scanPackage(scanCfg, pkgCfg):
 
     # get list of files to include in Package
     try:
-        filesToScan = []
-        with open(pkgCfg.fileListPath, "r") as flist:
-            lines = flist.readlines()
-            for l in lines:
-                filesToScan.append(l.rstrip())
-    except OSError as e:
+        # read and split the whole list at once, skipping blank lines
+        with open(pkgCfg.fileListPath, "rb") as flist:
+            lines = flist.read().decode("utf-8").splitlines()
+        filesToScan = [l for l in lines if l]
+    except (OSError, UnicodeDecodeError) as e:
         print(f"Error loading {pkgCfg.fileListPath}: {str(e)}")
         return None
 
     # prepare Package metadata
     pkg = Package(pkgCfg)
 
-    # walk through and create each File object, scan it, and add to the package
-    for fileRelPath in filesToScan:
+    # walk through and create each File object, and add to the package
+    # File SPDX IDs only need to be unique within the Document, so number
+    # them within this Package rather than generating random UUIDs
+    files = []
+    basedir = os.path.abspath(pkg.cfg.basedir)
+    idPrefix = f"SPDXRef-File-{pkg.cfg.spdxID.removeprefix('SPDXRef-')}-"
+    for idx, fileRelPath in enumerate(filesToScan):
         f = File(pkg)
         f.relpath = fileRelPath
-        f.abspath = os.path.normpath(os.path.join(os.path.abspath(pkg.cfg.basedir), fileRelPath))
-        f.spdxID = f"SPDXRef-File-{str(uuid.uuid4())}"
+        f.abspath = os.path.normpath(os.path.join(basedir, fileRelPath))
+        f.spdxID = f"{idPrefix}{idx}"
         pkg.files[f.spdxID] = f
-
-        # get hashes for file
-        hashes = getHashes(f.abspath)
-        if not hashes:
-            continue
-        hSHA1, hSHA256 = hashes
-        f.sha1 = hSHA1
-        if scanCfg.doSHA256:
+        files.append(f)
+
+    # paths that refer to the same file on disk (listed more than once, or
+    # hardlinked) only need to be scanned once, so group them by device
+    # and inode; missing files are keyed by path and left to scanFile
+    keys = []
+    toScan = {}
+    for f in files:
+        try:
+            st = os.stat(f.abspath)
+        except OSError:
+            st = None
+        if st and st.st_ino:
+            key = (st.st_dev, st.st_ino)
+        else:
+            key = f.abspath
+        keys.append(key)
+        if key not in toScan:
+            toScan[key] = f.abspath
+
+    # hash and scan the unique files in parallel, then fill in the results;
+    # with only one worker or a few files, a pool would just add overhead
+    numWorkers = scanCfg.numWorkers or os.cpu_count() or 1
+    args = (toScan.values(), repeat(scanCfg.numLinesScanned), repeat(scanCfg.doSHA256))
+    if numWorkers == 1 or len(toScan) < PARALLEL_SCAN_MIN_FILES:
+        results = dict(zip(toScan, map(scanFile, *args)))
+    else:
+        with ProcessPoolExecutor(max_workers=numWorkers) as ex:
+            results = dict(zip(toScan, ex.map(scanFile, *args, chunksize=64)))
+
+    for f, key in zip(files, keys):
+        result = results[key]
+        if result:
+            hSHA1, hSHA256, expression = result
+            f.sha1 = hSHA1
             f.sha256 = hSHA256
-
-        # get licenses for file
-        expression = getExpressionData(f.abspath, scanCfg.numLinesScanned)
-        if expression:
-            if scanCfg.shouldConcludeFileLicenses:
-                f.concludedLicense = expression
-            f.licenseInfoInFile = splitExpression(expression)
+            if expression:
+                if scanCfg.shouldConcludeFileLicenses:
+                    f.concludedLicense = expression
+                f.licenseInfoInFile = splitExpression(expression)
+        pkg.fileSHA1s.append(f.sha1)
+        pkg.fileConcludedLicenses.append(f.concludedLicense)
+        pkg.fileLicenseInfos.append(f.licenseInfoInFile)
 
     # now, assemble the Package data
     licsConcluded, licsFromFiles = getPackageLicenses(pkg)
@@ -92,6 +143,84 @@ def scanPackage(scanCfg, pkgCfg):
 
     return pkg
 
+def scanFile(filePath, numLines, doSHA256):
+    """
+    Calculate hashes and scan for an SPDX expression for a single file,
+    reading it only once. Runs in a worker process, so it must stay at
+    module level.
+
+    Arguments:
+        - filePath: path to file to scan.
+        - numLines: number of lines to scan for an expression before
+                    giving up. If 0, will scan the entire file.
+        - doSHA256: whether to also calculate the SHA256 hash.
+    Returns: tuple of (SHA1, SHA256 or "", expression or None), or None
+             if file is not found.
+    """
+    hSHA1 = hashlib.sha1()
+    hashers = [hSHA1]
+    if doSHA256:
+        hSHA256 = hashlib.sha256()
+        hashers.append(hSHA256)
+
+    try:
+        with open(filePath, "rb", buffering=0) as f:
+            # only a regular file's size is meaningful, and even then it
+            # is only a hint: e.g. procfs and sysfs files report a size of
+            # 0 regardless of their content
+            st = os.fstat(f.fileno())
+            size = st.st_size if stat.S_ISREG(st.st_mode) else None
+            mm = None
+            if size is not None and size >= PARALLEL_HASH_MIN_SIZE:
+                try:
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                except ValueError:
+                    # the file was emptied since the fstat(), so it can't be
+                    # mmapped; fall back to reading whatever is left of it
+                    size = None
+            if mm is not None:
+                with mm:
+                    expression = findExpression(mm, getScanEnd(mm, numLines))
+                    if doSHA256:
+                        hashInParallel(mm, hSHA1, hSHA256)
+                    else:
+                        hSHA1.update(mm)
+            else:
+                # look for the expression in the first chunk, then hash
+                # it together with the rest of the file; when the size is
+                # known, the read is sized to the file so that small files
+                # don't allocate a full chunk-sized buffer for a few bytes;
+                # a size of 0 may be wrong (see above), so empty files are
+                # still read, but only with a small read
+                if size is None:
+                    head = f.read(HASH_CHUNK_SIZE)
+                elif size > 0:
+                    head = f.read(min(size, HASH_CHUNK_SIZE))
+                else:
+                    head = f.read(HASH_MIN_BUFFER_SIZE)
+                end = getScanEnd(head, numLines)
+                expression = findExpression(head, end)
+                for h in hashers:
+                    h.update(head)
+                # size is only a hint here, since the file may be changing;
+                # hashChunks reads until EOF anyway, and when the whole file
+                # is expected to be in head it just checks for EOF; if head
+                # is empty, EOF has already been reached
+                if head:
+                    remaining = None if size is None else max(size - len(head), 0)
+                    rest = hashChunks(f, hashers, remaining)
+                else:
+                    rest = 0
+
+                # if the lines to be scanned run past the first chunk,
+                # the search above wasn't conclusive, so rescan the file
+                if end == len(head) and rest > 0:
+                    expression = getExpressionData(filePath, numLines)
+    except OSError:
+        return None
+
+    return (hSHA1.hexdigest(), hSHA256.hexdigest() if doSHA256 else "", expression)
+
 def parseLineForExpression(line):
     """Return parsed SPDX expression if tag found in line, or None otherwise."""
     p = line.partition("SPDX-License-Identifier:")
@@ -103,6 +232,51 @@ def parseLineForExpression(line):
     expression = expression.strip()
     return expression
 
+def getScanEnd(buf, numLines):
+    """
+    Find where scanning for an SPDX expression should stop.
+
+    Arguments:
+        - buf: bytes-like object with the file contents.
+        - numLines: number of lines to scan. If 0, scan the entire buffer.
+    Returns: offset just past the end of line numLines, or len(buf) if
+             the buffer has fewer lines.
+    """
+    if numLines <= 0:
+        return len(buf)
+    pos = 0
+    for _ in range(numLines):
+        pos = buf.find(b"\n", pos)
+        if pos == -1:
+            return len(buf)
+        pos += 1
+    return pos
+
+def findExpression(buf, end):
+    """
+    Search a buffer for the first SPDX-License-Identifier: tag, decoding
+    only the line that contains it.
+
+    Arguments:
+        - buf: bytes-like object with the file contents.
+        - end: offset at which to stop searching.
+    Returns: parsed expression if found; None if not found.
+    """
+    idx = buf.find(SPDX_TAG, 0, end)
+    while idx != -1:
+        eol = buf.find(b"\n", idx, end)
+        if eol == -1:
+            eol = end
+        try:
+            expression = parseLineForExpression(buf[idx:eol].decode("utf-8"))
+        except UnicodeDecodeError:
+            # invalid UTF-8 content
+            return None
+        if expression is not None:
+            return expression
+        idx = buf.find(SPDX_TAG, eol, end)
+    return None
+
 def getExpressionData(filePath, numLines):
     """
     Scans the specified file for the first SPDX-License-Identifier:
@@ -114,22 +288,15 @@ def getExpressionData(filePath, numLines):
                     giving up. If 0, will scan the entire file.
     Returns: parsed expression if found; None if not found.
     """
-    with open(filePath, "r") as f:
+    with open(filePath, "rb") as f:
+        # empty files can't be mmapped, and have no expression anyway; this
+        # also covers a file emptied after it was stat'ed
         try:
-            lineno = 0
-            for line in f:
-                lineno += 1
-                if lineno > numLines > 0:
-                    break
-                expression = parseLineForExpression(line)
-                if expression is not None:
-                    return expression
-        except UnicodeDecodeError:
-            # invalid UTF-8 content
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
             return None
-
-    # if we get here, we didn't find an expression
-    return None
+        with mm:
+            return findExpression(mm, getScanEnd(mm, numLines))
 
 def splitExpression(expression):
     """
@@ -140,10 +307,10 @@ def splitExpression(expression):
     Returns: array of split identifiers
     """
     # remove parens and plus sign
-    e2 = re.sub(r'\(|\)|\+', "", expression, flags=re.IGNORECASE)
+    e2 = PARENS_PLUS_RE.sub("", expression)
 
     # remove word operators, ignoring case, leaving a blank space
-    e3 = re.sub(r' AND | OR | WITH ', " ", e2, flags=re.IGNORECASE)
+    e3 = OPERATORS_RE.sub(" ", e2)
 
     # and split on space
     e4 = e3.split(" ")
@@ -158,14 +325,15 @@ def calculateVerificationCode(pkg):
         - pkg: Package
     Returns: verification code as string
     """
-    hashes = []
-    for f in pkg.files.values():
-        hashes.append(f.sha1)
-    hashes.sort()
-    filelist = "".join(hashes)
+    # hex digests sort the same as bytes as they do as text, so encode them
+    # once up front and sort the bytes
+    hashes = sorted(h.encode('ascii') for h in pkg.fileSHA1s)
 
+    # feed the sorted hashes straight into SHA1, which gives the same result
+    # as hashing their concatenation without building it
     hSHA1 = hashlib.sha1()
-    hSHA1.update(filelist.encode('utf-8'))
+    for h in hashes:
+        hSHA1.update(h)
     return hSHA1.hexdigest()
 
 def getPackageLicenses(pkg):
@@ -177,13 +345,9 @@ def getPackageLicenses(pkg):
     Returns: sorted list of concluded license exprs,
              sorted list of infoInFile ID's
     """
-    licsConcluded = set()
-    licsFromFiles = set()
-    for f in pkg.files.values():
-        licsConcluded.add(f.concludedLicense)
-        for licInfo in f.licenseInfoInFile:
-            licsFromFiles.add(licInfo)
-    return sorted(list(licsConcluded)), sorted(list(licsFromFiles))
+    licsConcluded = set(pkg.fileConcludedLicenses)
+    licsFromFiles = set(chain.from_iterable(pkg.fileLicenseInfos))
+    return sorted(licsConcluded), sorted(licsFromFiles)
 
 def normalizeExpression(licsConcluded):
     """
@@ -3,26 +3,71 @@
 # Based on zspdx/util.py from Zephyr Project:
 # Copyright (c) 2020, 2021 The Linux Foundation
 
-import hashlib
+from concurrent.futures import ThreadPoolExecutor
 
-def getHashes(filePath):
+# number of bytes read at a time when hashing files
+HASH_CHUNK_SIZE = 1 << 20
+
+# files at least this large are mmapped and have their SHA1 and SHA256
+# hashes calculated concurrently in two threads; hashlib releases the GIL
+# while hashing large buffers, so the two hashes run on separate cores
+PARALLEL_HASH_MIN_SIZE = 16 << 20
+
+# smallest read buffer used when hashing a file whose size is known, so
+# that a file which has grown since it was stat'ed isn't read in tiny pieces;
+# also the size of the read that checks for EOF when no more data is expected
+HASH_MIN_BUFFER_SIZE = 64 << 10
+
+def hashChunks(f, hashers, size=None):
+    """
+    Update each hasher with the remaining contents of an open file, reading
+    until EOF.
+
+    Arguments:
+        - f: file object opened in binary mode, ideally unbuffered.
+        - hashers: hash objects to update.
+        - size: number of bytes expected to remain in f, or None if unknown.
+                Only used as a hint to size the read buffer, since a file
+                may change after it was stat'ed.
+    Returns: number of bytes read.
+    """
+    if size is None:
+        bufSize = HASH_CHUNK_SIZE
+    elif size > 0:
+        bufSize = max(min(size, HASH_CHUNK_SIZE), HASH_MIN_BUFFER_SIZE)
+    else:
+        # nothing is expected to remain, so just check for EOF with a small
+        # read rather than allocating a buffer; but procfs and sysfs files
+        # report a size of 0 despite having content, so keep going if any
+        data = f.read(HASH_MIN_BUFFER_SIZE)
+        if not data:
+            return 0
+        for h in hashers:
+            h.update(data)
+        return len(data) + hashChunks(f, hashers)
+
+    # read into a single reusable buffer, so that all hashers are fed from
+    # the same bytes without extra copies
+    buf = bytearray(bufSize)
+    view = memoryview(buf)
+    total = 0
+    while n := f.readinto(buf):
+        chunk = view[:n]
+        for h in hashers:
+            h.update(chunk)
+        total += n
+    return total
+
+def hashInParallel(buf, hSHA1, hSHA256):
     """
-    Scan for and return hashes.
+    Update the SHA1 and SHA256 hashers with the same buffer, concurrently.
 
     Arguments:
-        - filePath: path to file to scan.
-    Returns: tuple of (SHA1, SHA256) hashes for filePath, or
-             None if file is not found.
+        - buf: bytes-like object (e.g. an mmap) with the full file contents.
+        - hSHA1: SHA1 hash object to update.
+        - hSHA256: SHA256 hash object to update.
     """
-    hSHA1 = hashlib.sha1()
-    hSHA256 = hashlib.sha256()
-
-    try:
-        with open(filePath, 'rb') as f:
-            buf = f.read()
-            hSHA1.update(buf)
-            hSHA256.update(buf)
-    except OSError:
-        return None
-
-    return (hSHA1.hexdigest(), hSHA256.hexdigest())
+    with ThreadPoolExecutor(max_workers=1) as ex:
+        fut = ex.submit(hSHA256.update, buf)
+        hSHA1.update(buf)
+        fut.result()
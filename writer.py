@@ -10,17 +10,67 @@ import os
 
 from __init__ import VERSION
 
+# use orjson to serialize JSON if it's installed, since its encoder is much
+# faster than the standard library's; fall back to json otherwise
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# options for the standard library's JSON encoder: SPDX data has no cycles
+# or NaNs to guard against, and non-ASCII text is written as UTF-8 rather
+# than escaped (matching orjson's output)
+JSON_OPTIONS = {"check_circular": False, "allow_nan": False, "ensure_ascii": False}
+
+# documents with at least this many Files are written one File at a time,
+# rather than built and serialized in memory first, to bound peak memory
+STREAM_MIN_FILES = 100000
+
+# size of the write buffer used when streaming JSON output
+WRITE_BUFFER_SIZE = 1 << 20
+
+# comment for each "LicenseRef-" entry in "Other Licensing Info", formatted
+# with the license ID
+LICENSEREF_COMMENT = "Corresponds to the license ID `%s` detected in an SPDX-License-Identifier: tag."
+
+# Serialize data to UTF-8 encoded JSON bytes.
+# Arguments:
+# 1) data: JSON-serializable data
+# 2) pretty: bool for whether to pretty-print (with 2-space indent)
+def encodeJSON(data, pretty):
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 if pretty else 0)
+    return json.dumps(data, indent=2 if pretty else None, **JSON_OPTIONS).encode("utf-8")
+
+# Write bytes to a file with os.write(), bypassing Python's buffered IO
+# layer, since the data is already fully encoded.
+# Arguments:
+# 1) path: path of file to create or overwrite
+# 2) data: bytes to write
+def writeBytes(path, data):
+    # O_BINARY only exists (and is only needed) on Windows
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+    fd = os.open(path, flags, 0o666)
+    try:
+        # os.write() may write less than requested, so loop until done
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+
 # Create and return dict for SPDX File JSON data.
 # arguments:
 # 1) f: File (defined in datatypes.py)
 def makeSPDXJSONFile(f):
-    fj = {}
-    fj["SPDXID"] = f.spdxID
-    fj["fileName"] = f.relpath
-    fj["licenseConcluded"] = f.concludedLicense
-    fj["licenseInfoInFiles"] = f.licenseInfoInFile
-    fj["copyrightText"] = f.copyrightText
-    fj["checksums"] = [{"algorithm": "SHA1", "checksumValue": f.sha1}]
+    fj = {
+        "SPDXID": f.spdxID,
+        "fileName": f.relpath,
+        "licenseConcluded": f.concludedLicense,
+        "licenseInfoInFiles": f.licenseInfoInFile,
+        "copyrightText": f.copyrightText,
+        "checksums": [{"algorithm": "SHA1", "checksumValue": f.sha1}],
+    }
     if f.sha256:
         fj["checksums"].append({"algorithm": "SHA256", "checksumValue": f.sha256})
     return fj
@@ -28,11 +78,14 @@ def makeSPDXJSONFile(f):
 # Create and return dict for SPDX Package JSON data.
 # Will also create File JSON dict objects for all Files contained
 # in this Package, add them to the "files" list, and add them to
-# the "hasFiles" list for this Package.
+# the "hasFiles" list for this Package; and will add the Package's
+# "LicenseRef-" license IDs to the licenseRefs set.
 # Arguments:
 # 1) p: Package (as defined in datatypes.py)
-# 2) docFiles: list of all files in this _Document_
-def makeSPDXJSONPackage(p, docFiles):
+# 2) docFiles: list of all files in this _Document_, or None to skip
+#    creating File JSON dict objects (e.g. if they'll be streamed)
+# 3) licenseRefs: set of all "LicenseRef-" IDs in this _Document_
+def makeSPDXJSONPackage(p, docFiles, licenseRefs):
     pj = {}
 
     # get data from PackageConfig
@@ -41,9 +94,9 @@ def makeSPDXJSONPackage(p, docFiles):
     if p.cfg.version:
         pj["versionInfo"] = p.cfg.version
     if p.cfg.supplierOrg:
-        pj["supplier"] = f"Organization: {p.cfg.supplierOrg}"
+        pj["supplier"] = "Organization: " + p.cfg.supplierOrg
     elif p.cfg.supplierPerson:
-        pj["supplier"] = f"Person: {p.cfg.supplierPerson}"
+        pj["supplier"] = "Person: " + p.cfg.supplierPerson
     pj["licenseDeclared"] = p.cfg.declaredLicense
     pj["copyrightText"] = p.cfg.copyrightText
     # FIXME move downloadLocation into PackageConfig?
@@ -58,107 +111,140 @@ def makeSPDXJSONPackage(p, docFiles):
         "packageVerificationCodeValue": p.verificationCode,
     }
 
-    pj["hasFiles"] = []
-    for fID, f in p.files.items():
-        fj = makeSPDXJSONFile(f)
-        # FIXME might check whether a File with this ID is already in docFiles
-        docFiles.append(fj)
-        pj["hasFiles"].append(fID)
+    # add all of the Package's Files, using the same makeSPDXJSONFile()
+    # that writeSPDXJSONStream() uses, so both outputs stay identical
+    # FIXME might check whether a File with this ID is already in docFiles
+    pj["hasFiles"] = list(p.files)
+    if docFiles is not None:
+        docFiles.extend(map(makeSPDXJSONFile, p.files.values()))
+
+    # check the package's own declared license and its
+    # licenseInfoFromFiles => shouldn't need to check each individual file
+    # prefixes are compared by slicing (11 == len("LicenseRef-")), which is
+    # cheaper than a startswith() method call per license
+    # FIXME for declared license, should check components of expression
+    # FIXME should also handle DocumentRef-...:LicenseRef-... format
+    licenseRefs.update(
+        l
+        for l in (p.cfg.declaredLicense, *p.licenseInfoFromFiles)
+        if l[:11] == "LicenseRef-"
+    )
 
     return pj
 
 # Create and return array for SPDX "Other Licensing Info"
 # sections based on "LicenseRef-" license IDs in SPDX Document,
 # or empty list if none.
-def makeSPDXJSONOtherLicensingInfo(doc):
+# Arguments:
+# 1) licenseRefs: set of "LicenseRef-" IDs, as gathered by
+#    makeSPDXJSONPackage() for each Package in the Document
+def makeSPDXJSONOtherLicensingInfo(licenseRefs):
     # FIXME for now, just create placeholder extractedText for each
-    licenseRefs = set()
-
-    # FIXME should also handle DocumentRef-...:LicenseRef-... format
-    for pkg in doc.pkgs.values():
-        # check package's own licenses
-        # FIXME for declared license, should check components of expression
-        if pkg.cfg.declaredLicense.startswith("LicenseRef-"):
-            licenseRefs.add(pkg.cfg.declaredLicense)
-        # check licenseInfoFromFiles => shouldn't need to check each
-        # individual file
-        for l in pkg.licenseInfoFromFiles:
-            if l.startswith("LicenseRef-"):
-                licenseRefs.add(l)
-
-    lj = []
-    for lr in sorted(licenseRefs):
-        lj.append({
-            "licenseId": lr,
-            "comment": f"Corresponds to the license ID `{lr}` detected in an SPDX-License-Identifier: tag.",
-            "extractedText": lr,
-            "name": lr,
-        })
-    return lj
+    return [{
+        "licenseId": lr,
+        "comment": LICENSEREF_COMMENT % lr,
+        "extractedText": lr,
+        "name": lr,
+    } for lr in sorted(licenseRefs)]
 
 # Create and return dict for SPDX Document JSON data, with
 # sources and builds packages, all corresponding files, and
 # all related relationships and other metadata.
 # Arguments:
 # 1) doc: Document (defined in datatypes.py)
-def makeSPDXJSONDocument(doc):
-    dj = {}
-
-    # set up main document data
+# 2) withFiles: bool for whether to fill in the "files" list; if False,
+#    it is left empty (e.g. so that Files can be streamed separately)
+def makeSPDXJSONDocument(doc, withFiles=True):
+    # set up main document data and creation info
     dj = {
         "spdxVersion": "SPDX-2.2",
         "dataLicense": "CC0-1.0",
         "SPDXID": "SPDXRef-DOCUMENT",
         "name": doc.cfg.name,
         "documentNamespace": doc.cfg.namespace,
-        "documentDescribes": [],
+        "documentDescribes": list(doc.pkgs),
         "packages": [],
         "files": [],
         "relationships": [],
+        "creationInfo": {
+            "created": datetime.utcnow().replace(microsecond=0).isoformat() + "Z",
+            "creators": [f"Tool: spdx-builder-{VERSION}"],
+        },
     }
 
-    # set up document creation info
-    dc = {}
-    dc["created"] = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
-    dc["creators"] = [f"Tool: spdx-builder-{VERSION}"]
-    dj["creationInfo"] = dc
-
-    # add a package section for each package
-    for pkgID, pkg in doc.pkgs.items():
-        dj["documentDescribes"].append(pkgID)
-        pj = makeSPDXJSONPackage(pkg, dj["files"])
-        dj["packages"].append(pj)
+    # add a package section for each package, and its files to the
+    # document's files, gathering "LicenseRef-" IDs along the way
+    licenseRefs = set()
+    dj["packages"] = [
+        makeSPDXJSONPackage(pkg, dj["files"] if withFiles else None, licenseRefs)
+        for pkg in doc.pkgs.values()
+    ]
 
     # add each relationship
-    for rln in doc.relationships:
-        rj = {
-            "spdxElementId": rln.refA,
-            "relatedSpdxElement": rln.refB,
-            "relationshipType": rln.rlnType,
-        }
-        dj["relationships"].append(rj)
+    dj["relationships"] = [{
+        "spdxElementId": rln.refA,
+        "relatedSpdxElement": rln.refB,
+        "relationshipType": rln.rlnType,
+    } for rln in doc.relationships]
 
     # add other license info section, if any
-    lj = makeSPDXJSONOtherLicensingInfo(doc)
+    lj = makeSPDXJSONOtherLicensingInfo(licenseRefs)
     if len(lj) > 0:
         dj["hasExtractedLicensingInfos"] = lj
 
     return dj
 
+# Write SPDX JSON Document incrementally, encoding one File at a time,
+# so that neither all of the File JSON dicts nor the full JSON text need
+# to be held in memory at once. The output is the same as encoding the
+# result of makeSPDXJSONDocument() in one go.
+# Arguments:
+# 1) f: file object opened for writing in binary mode
+# 2) doc: Document (defined in datatypes.py)
+# 3) pretty: bool for whether to pretty-print JSON output
+def writeSPDXJSONStream(f, doc, pretty):
+    # encode everything except the Files, and split it just inside the
+    # empty "files" list; '"files":' can only appear unescaped as that key
+    skeleton = encodeJSON(makeSPDXJSONDocument(doc, withFiles=False), pretty)
+    split = skeleton.index(b"[", skeleton.index(b'"files":')) + 1
+    f.write(skeleton[:split])
+
+    # lay out the list items the same way the encoder would have
+    if pretty:
+        first, sep, last = b"\n    ", b",\n    ", b"\n  "
+    else:
+        first, sep, last = b"", b"," if orjson is not None else b", ", b""
+    prefix = first
+    for pkg in doc.pkgs.values():
+        for sf in pkg.files.values():
+            fj = encodeJSON(makeSPDXJSONFile(sf), pretty)
+            if pretty:
+                fj = fj.replace(b"\n", b"\n    ")
+            f.write(prefix)
+            f.write(fj)
+            prefix = sep
+    if prefix is sep:
+        f.write(last)
+
+    f.write(skeleton[split:])
+
 # create and output SPDX JSON Document
 # Arguments:
 # 1) outputDir: folder to output SPDX JSON
 # 2) doc: Document (defined in datatypes.py)
 # 3) pretty: bool for whether to pretty-print JSON output
 def writeSPDX(outputDir, doc, pretty):
-    dj = makeSPDXJSONDocument(doc)
-
     # FIXME for single document output, maybe allow specifying full path
     spdxFilename = os.path.join(outputDir, "doc.spdx.json")
-    with open(spdxFilename, "w") as f:
-        if pretty:
-            ds = json.dump(dj, f, indent=2)
-        else:
-            ds = json.dump(dj, f)
-        print(f"Wrote SPDX JSON document to {spdxFilename}")
+    numFiles = sum(len(pkg.files) for pkg in doc.pkgs.values())
+    if numFiles >= STREAM_MIN_FILES:
+        # stream very large documents through a large buffer to bound peak
+        # memory
+        with open(spdxFilename, "wb", buffering=WRITE_BUFFER_SIZE) as f:
+            writeSPDXJSONStream(f, doc, pretty)
+    else:
+        # otherwise serialize the whole document in one go and write it
+        # with a single call, rather than through many small writes
+        writeBytes(spdxFilename, encodeJSON(makeSPDXJSONDocument(doc), pretty))
+    print(f"Wrote SPDX JSON document to {spdxFilename}")
     # FIXME handle exceptions, e.g. OSError